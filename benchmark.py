@@ -0,0 +1,219 @@
+"""
+Regression benchmark of the text processing stages of the worker. Each stage is run on the bundled corpus, the outputs
+are compared to the recorded golden outputs and the throughput is compared to a recorded baseline. Sentencepiece
+encoding and decoding are only benchmarked if a model configuration is given, the model checkpoint is not loaded.
+
+python benchmark.py [--model-config models/config.yaml] [--scale 20] [--tolerance 0.2] [--record]
+"""
+import os
+import sys
+import copy
+import json
+import logging
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+
+from nmt_worker import read_model_config
+from nmt_worker.schemas import InputType
+from nmt_worker.tag_utils import preprocess_tags, postprocess_tags
+from nmt_worker.normalization import normalize
+from nmt_worker.tokenization import sentence_tokenize
+
+logger = logging.getLogger("benchmark")
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark')
+MAX_POSITIONS = 1024
+
+
+class Stage:
+    def __init__(self, name: str, function: Callable, inputs: List[Any], size: Callable[[Any], int],
+                 mutates: bool = False):
+        """
+        :param name: stage name used in the golden and baseline files
+        :param function: a function that processes the input of a single corpus entry
+        :param inputs: inputs of all corpus entries
+        :param size: a function that returns the number of characters in an input
+        :param mutates: whether the function modifies its input, in which case a copy is used in each run
+        """
+        self.name = name
+        self.function = function
+        self.inputs = inputs
+        self.characters = sum(size(x) for x in inputs)
+        self.mutates = mutates
+
+    def run(self) -> List[Any]:
+        inputs = copy.deepcopy(self.inputs) if self.mutates else self.inputs
+        # JSON round trip converts tuples to lists to match the golden outputs
+        return json.loads(json.dumps([self.function(x) for x in inputs], ensure_ascii=False))
+
+    def throughput(self, scale: int, repeat: int) -> float:
+        """
+        Characters per second of the fastest of `repeat` runs on the corpus repeated `scale` times.
+        """
+        best = float('inf')
+        for _ in range(repeat):
+            inputs = [copy.deepcopy(x) for x in self.inputs * scale] if self.mutates else self.inputs * scale
+            t1 = perf_counter()
+            for x in inputs:
+                self.function(x)
+            best = min(best, perf_counter() - t1)
+        return self.characters * scale / best
+
+
+def _sentences_size(sentences: List[str]) -> int:
+    return sum(len(sentence) for sentence in sentences)
+
+
+def _load_interface(model_config_path: str):
+    from fairseq.data import Dictionary
+    from sentencepiece import SentencePieceProcessor
+    from torch.nn import Module
+    from nmt_worker.modular_interface import ModularHubInterface
+
+    model_config = read_model_config(model_config_path)
+    if not model_config.modular:
+        raise ValueError("Encoding and decoding can only be benchmarked with modular models.")
+    languages = sorted({lang for pair in model_config.language_pairs for lang in pair.split('-')})
+
+    # only the text processing methods are used, so the model itself is not loaded
+    interface = ModularHubInterface.__new__(ModularHubInterface)
+    Module.__init__(interface)
+    interface.sp_models = {lang: SentencePieceProcessor(model_file=f"{model_config.sentencepiece_prefix}.{lang}.model")
+                           for lang in languages}
+    interface.dicts = {lang: Dictionary.load(os.path.join(model_config.dict_dir, f"dict.{lang}.txt"))
+                       for lang in languages}
+    return interface, model_config.huggingface or model_config.model_root
+
+
+def build_stages(corpus: List[Dict[str, str]], model_config_path: Optional[str] = None) -> List[Stage]:
+    # the stages are chained in the same way as in Translator.process_request
+    input_types = [InputType(entry['input_type']) for entry in corpus]
+    sentences = [sentence_tokenize(entry['text'], MAX_POSITIONS)[0] for entry in corpus]
+    preprocessed = [preprocess_tags(entry_sentences, input_type)
+                    for entry_sentences, input_type in zip(sentences, input_types)]
+    normalized = [[normalize(sentence) for sentence in detagged] for detagged, _ in preprocessed]
+
+    stages = [
+        Stage('sentence_tokenize', lambda text: sentence_tokenize(text, MAX_POSITIONS),
+              [entry['text'] for entry in corpus], len),
+        Stage('preprocess_tags', lambda x: preprocess_tags(*x),
+              list(zip(sentences, input_types)), lambda x: _sentences_size(x[0])),
+        Stage('normalize', lambda x: [normalize(sentence) for sentence in x],
+              [detagged for detagged, _ in preprocessed], _sentences_size),
+        # the normalized text is used as the translation
+        Stage('postprocess_tags', lambda x: postprocess_tags(*x),
+              [(translations, tags, input_type) for translations, (_, tags), input_type
+               in zip(normalized, preprocessed, input_types)], lambda x: _sentences_size(x[0]), mutates=True),
+    ]
+
+    if model_config_path is not None:
+        interface, model_name = _load_interface(model_config_path)
+        entries = [(entry_sentences, entry['lang']) for entry_sentences, entry in zip(normalized, corpus)
+                   if entry['lang'] in interface.sp_models]
+        encoded = [([interface.encode(sentence, lang) for sentence in entry_sentences], lang) for entry_sentences, lang in entries]
+        stages += [
+            Stage(f'encode[{model_name}]', lambda x: [interface.encode(sentence, x[1]).tolist() for sentence in x[0]],
+                  entries, lambda x: _sentences_size(x[0])),
+            Stage(f'decode[{model_name}]', lambda x: [interface.decode(tokens, x[1]) for tokens in x[0]],
+                  encoded, lambda x: sum(len(interface.decode(tokens, x[1])) for tokens in x[0])),
+        ]
+
+    return stages
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def _first_difference(outputs: List[Any], golden: List[Any]) -> Optional[str]:
+    if len(outputs) != len(golden):
+        return f"{len(outputs)} outputs, {len(golden)} expected (the corpus has changed, record new outputs)"
+    for idx, (output, expected) in enumerate(zip(outputs, golden)):
+        if output != expected:
+            return f"entry {idx}: {json.dumps(output, ensure_ascii=False)} != " \
+                   f"{json.dumps(expected, ensure_ascii=False)}"
+    return None
+
+
+def main(args) -> bool:
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    stages = build_stages(corpus, args.model_config)
+    if args.stages:
+        stages = [stage for stage in stages if stage.name.split('[')[0] in args.stages]
+
+    golden = _read_json(args.golden)
+    baseline = _read_json(args.baseline)
+    passed = True
+
+    for stage in stages:
+        outputs = stage.run()
+        throughput = stage.throughput(args.scale, args.repeat)
+
+        if args.record:
+            golden[stage.name] = outputs
+            baseline[stage.name] = round(throughput)
+            logger.info(f"{stage.name}: {round(throughput)} chars/s, recorded")
+            continue
+
+        if stage.name not in golden:
+            status = "no golden outputs, record them with --record"
+            passed = False
+        else:
+            difference = _first_difference(outputs, golden[stage.name])
+            status = "outputs OK" if difference is None else f"outputs differ, {difference}"
+            passed &= difference is None
+
+        if stage.name in baseline:
+            ratio = throughput / baseline[stage.name]
+            status += f", {round(100 * (ratio - 1), 1):+}% vs baseline"
+            if ratio < 1 - args.tolerance:
+                status += " (regression)"
+                passed = False
+        else:
+            status += ", no baseline"
+
+        logger.info(f"{stage.name}: {round(throughput)} chars/s, {status}")
+
+    if args.record:
+        _write_json(args.golden, golden)
+        _write_json(args.baseline, baseline)
+
+    return passed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark text processing stages and compare their outputs and throughput to "
+                                        "recorded golden outputs and baselines.")
+    parser.add_argument('--model-config', default=None,
+                        help="The model config YAML file, enables sentencepiece encoding and decoding stages.")
+    parser.add_argument('--stages', nargs='+', default=None,
+                        help="Stages to run (sentence_tokenize, preprocess_tags, normalize, postprocess_tags, encode, "
+                             "decode), all by default.")
+    parser.add_argument('--corpus', default=os.path.join(BENCHMARK_DIR, 'corpus.jsonl'), help="Benchmark corpus.")
+    parser.add_argument('--golden', default=os.path.join(BENCHMARK_DIR, 'golden.json'), help="Golden outputs file.")
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARK_DIR, 'baseline.json'),
+                        help="Throughput baseline file. Baselines depend on the hardware and should be recorded on "
+                             "the machine where the benchmark is run.")
+    parser.add_argument('--scale', type=int, default=20, help="Number of times the corpus is repeated for timing.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs, the fastest one is used.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Max allowed throughput decrease relative to the baseline (0.2 = 20%%).")
+    parser.add_argument('--record', action='store_true',
+                        help="Record the outputs and throughput of the selected stages as the new golden outputs and "
+                             "baselines.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s")
+    sys.exit(0 if main(args) else 1)
@@ -1,11 +1,15 @@
+import hmac
+import asyncio
 import threading
 from argparse import ArgumentParser, FileType
+from typing import Optional
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from nmt_worker import read_model_config, Translator, MQConsumer
+from nmt_worker import read_model_config, worker_config, Translator, MQConsumer
 
 
 parser = ArgumentParser(
@@ -22,9 +26,21 @@ args = parser.parse_args()
 
 app = FastAPI()
 mq_thread = threading.Thread()
+consumer = None
+
+
+
+class PublicCORSMiddleware(CORSMiddleware):
+    # The admin endpoints are excluded from the CORS policy, so their responses cannot be read cross-origin
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith('/admin'):
+            await self.app(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
 
 app.add_middleware(
-    CORSMiddleware,
+    PublicCORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
@@ -34,7 +50,7 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup():
-    global mq_thread
+    global mq_thread, consumer
     model_config = read_model_config(args.model_config.name)
     translator = Translator(model_config)
     consumer = MQConsumer(translator=translator)
@@ -47,11 +63,15 @@ async def startup():
 
 @app.on_event("shutdown")
 async def shutdown():
-    global mq_thread
+    # Stop consuming and wait for the in-flight request to be responded to and acknowledged
+    global mq_thread, consumer
     mq_thread.consume = False
+    if consumer is not None:
+        consumer.stop()
+    if mq_thread.is_alive():
+        await asyncio.to_thread(mq_thread.join, worker_config.drain_timeout)
 
 
-@app.get('/health/readiness')
 @app.get('/health/startup')
 async def health_check():
     # Returns 200 if models are loaded and connection to RabbitMQ is up
@@ -61,6 +81,25 @@ async def health_check():
     return "OK"
 
 
+@app.get('/health/readiness')
+async def readiness():
+    # Returns 503 if the worker is saturated, otherwise same as the startup probe
+    global consumer
+    await health_check()
+    if consumer.stats.snapshot()['saturated']:
+        raise HTTPException(503, detail="Saturated")
+    return "OK"
+
+
+@app.get('/health/load')
+async def load():
+    # Returns queue depth, in-flight requests, recent throughput and latency percentiles
+    global mq_thread, consumer
+    if consumer is None:
+        raise HTTPException(500)
+    return {'connected': mq_thread.is_alive() and getattr(mq_thread, "connected"), **consumer.stats.snapshot()}
+
+
 @app.get('/health/liveness')
 async def liveness():
     global mq_thread
@@ -68,5 +107,38 @@ async def liveness():
         raise HTTPException(500)
     return "OK"
 
+
+def verify_profiling_token(authorization: Optional[str] = Header(None)):
+    # Admin endpoints require the `Authorization: Bearer <WORKER_PROFILING_TOKEN>` header
+    expected = f"Bearer {worker_config.profiling_token}".encode('utf-8')
+    if authorization is None or not hmac.compare_digest(authorization.encode('utf-8'), expected):
+        raise HTTPException(401, detail="Invalid profiling token.", headers={'WWW-Authenticate': 'Bearer'})
+
+
+if worker_config.profiling:
+    @app.get('/admin/profile', response_class=PlainTextResponse, dependencies=[Depends(verify_profiling_token)])
+    async def profile(duration: float = 10):
+        # Samples the consumer thread for `duration` seconds and returns the stacks in the folded flame graph format
+        global consumer
+        if consumer is None:
+            raise HTTPException(500)
+        if not 0 < duration <= worker_config.profiling_max_duration:
+            raise HTTPException(400, detail=f"Duration must be between 0 and {worker_config.profiling_max_duration}.")
+        try:
+            stacks = await asyncio.to_thread(consumer.profiler.capture, duration)
+        except RuntimeError as e:
+            raise HTTPException(409, detail=str(e))
+        return PlainTextResponse(stacks, headers={'Content-Disposition': 'attachment; filename="profile.folded"'})
+
+    @app.get('/admin/profile/operators', response_class=PlainTextResponse,
+             dependencies=[Depends(verify_profiling_token)])
+    async def profile_operators():
+        # Returns the PyTorch operator summary of requests processed during the last capture
+        global consumer
+        if consumer is None:
+            raise HTTPException(500)
+        return consumer.profiler.operator_summary()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=args.port, log_config=args.log_config.name)
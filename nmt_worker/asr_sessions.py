@@ -0,0 +1,75 @@
+"""
+Translation cache for incremental ASR requests. Partial transcripts of the same utterance are sent repeatedly as they
+grow, so only the trailing sentence is unstable and all previous sentences can be reused from the session cache.
+"""
+from collections import OrderedDict
+from time import time
+from typing import Callable, List, Tuple
+
+
+class ASRSession:
+    def __init__(self, max_sentences: int):
+        self.max_sentences = max_sentences
+        self.last_access = time()
+        self.translations: OrderedDict[Tuple[str, str, str, str], str] = OrderedDict()
+
+    def get(self, key: Tuple[str, str, str, str]):
+        if key in self.translations:
+            self.translations.move_to_end(key)
+            return self.translations[key]
+        return None
+
+    def set(self, key: Tuple[str, str, str, str], translation: str):
+        self.translations[key] = translation
+        self.translations.move_to_end(key)
+        while len(self.translations) > self.max_sentences:
+            self.translations.popitem(last=False)
+
+
+class ASRSessionCache:
+    def __init__(self, ttl: int = 300, max_sessions: int = 1000, max_sentences: int = 1000):
+        """
+        :param ttl: number of seconds since the last request after which the session expires
+        :param max_sessions: max number of sessions stored, the least recently used sessions are removed first
+        :param max_sentences: max number of finalised sentence translations stored per session
+        """
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_sentences = max_sentences
+        self.sessions: OrderedDict[str, ASRSession] = OrderedDict()
+
+    def _prune(self, now: float):
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_access >= now - self.ttl and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[session_id]
+
+    def session(self, session_id: str) -> ASRSession:
+        now = time()
+        if session_id not in self.sessions:
+            self.sessions[session_id] = ASRSession(self.max_sentences)
+        session = self.sessions[session_id]
+        session.last_access = now
+        self.sessions.move_to_end(session_id)
+        self._prune(now)
+        return session
+
+    def translate(self, sentences: List[str], session_id: str, translate: Callable[..., List[str]],
+                  src: str, tgt: str, domain: str, **kwargs) -> List[str]:
+        """
+        Translate sentences of a partial transcript reusing the translations of finalised sentences. All sentences
+        except the last one are considered final.
+        """
+        session = self.session(session_id)
+        keys = [(src, tgt, domain, sentence) for sentence in sentences]
+        translations = [session.get(key) for key in keys[:-1]] + [None]
+
+        missing = [idx for idx, translation in enumerate(translations) if translation is None]
+        for idx, translation in zip(missing, translate([sentences[idx] for idx in missing],
+                                                       src=src, tgt=tgt, domain=domain, **kwargs)):
+            translations[idx] = translation
+            if idx < len(sentences) - 1:
+                session.set(keys[idx], translation)
+
+        return translations
@@ -2,7 +2,7 @@ import os
 import yaml
 from yaml.loader import SafeLoader
 from typing import List, Optional, Any
-from pydantic import BaseSettings, BaseModel
+from pydantic import BaseSettings, BaseModel, validator
 
 
 class MQConfig(BaseSettings):
@@ -26,6 +26,30 @@ class WorkerConfig(BaseSettings):
     Imports general workr configuration from environment variables
     """
     max_input_length: int = 10000
+    shard_threshold: int = 0  # sentences with at least as many characters in total are translated in shards, 0 disables
+    shard_workers: int = 2
+    shard_threads: int = 0  # intra-op threads per shard, by default the available threads are divided between shards
+    stats_window: int = 60  # length of the rolling window of load statistics in seconds
+    saturation_queue_depth: int = 0  # queue depth at which the worker is reported as saturated, 0 disables
+    saturation_latency: float = 0  # p90 latency (seconds) at which the worker is reported as saturated, 0 disables
+    drain_timeout: float = 25  # max seconds to wait for the in-flight request on shutdown
+    asr_session_ttl: int = 300  # seconds since the last request after which an ASR session expires, 0 disables
+    asr_max_sessions: int = 1000
+    asr_max_sentences: int = 1000  # max cached sentence translations per ASR session
+    compression: Optional[str] = None  # response content encoding, either gzip or zstd, disabled by default
+    compression_threshold: int = 65536  # min response size in bytes to apply compression
+    profiling: bool = False  # enables the /admin/profile endpoints
+    profiling_token: Optional[str] = None  # shared secret required by the /admin/profile endpoints
+    profiling_interval: float = 0.01  # stack sampling interval in seconds
+    profiling_max_duration: float = 60
+    slow_request_threshold: float = 0  # requests that take longer (seconds) are profiled automatically, 0 disables
+    slow_request_dir: str = '/tmp/profiles'
+
+    @validator('profiling_token', always=True)
+    def check_profiling_token(cls, token, values):
+        if values.get('profiling') and not token:
+            raise ValueError("a profiling token is required if profiling is enabled")
+        return token
 
     class Config:
         env_prefix = 'worker_'
@@ -43,12 +67,16 @@ class ModelConfig(BaseModel):
     dict_dir: str = ""
     sentencepiece_dir: str = ""
     sentencepiece_prefix: str = "sp-model"
+    shortlist_prefix: Optional[str] = None
+    shortlist_frequent: int = 1000
 
     def __init__(self, **data: Any):
         super().__init__(**data)
         self.checkpoint = os.path.join(self.model_root, self.checkpoint)
         self.sentencepiece_prefix = os.path.join(self.model_root, self.sentencepiece_dir, self.sentencepiece_prefix)
         self.dict_dir = os.path.join(self.model_root, self.dict_dir)
+        if self.shortlist_prefix is not None:
+            self.shortlist_prefix = os.path.join(self.model_root, self.shortlist_prefix)
 
     def download(self):
         if self.huggingface is not None:
@@ -1,3 +1,4 @@
+import os
 import logging
 import copy
 from typing import Dict, List, Iterator, Any, Optional
@@ -12,6 +13,8 @@ from omegaconf import open_dict, DictConfig
 
 from sentencepiece import SentencePieceProcessor
 
+from .shortlist import Shortlist, install_projections, restrict_output
+
 import torch
 from torch import Tensor, LongTensor
 from torch.nn import ModuleList, Module
@@ -25,7 +28,8 @@ class ModularHubInterface(Module):
             models: List[MultilingualTransformerModel],
             task: MultilingualTranslationTask,
             cfg: DictConfig,
-            sp_models: Dict[str, SentencePieceProcessor]
+            sp_models: Dict[str, SentencePieceProcessor],
+            shortlists: Optional[Dict[str, Shortlist]] = None
     ):
         super().__init__()
 
@@ -35,6 +39,7 @@ class ModularHubInterface(Module):
         self.cfg = cfg
         self.dicts: Dict[str, Dictionary] = task.dicts
         self.langs = task.langs
+        self.shortlists = shortlists or {}
 
         for model in self.models:
             model.prepare_for_inference_(self.cfg)
@@ -43,6 +48,11 @@ class ModularHubInterface(Module):
             self.task.max_positions(), *[model.max_positions() for model in self.models]
         )
 
+        self.shortlist_projections = {
+            lang_pair: install_projections(model.models[lang_pair].decoder for model in self.models)
+            for lang_pair in self.shortlists
+        }
+
         self.register_buffer("_float_tensor", torch.tensor([0], dtype=torch.float))
 
     @classmethod
@@ -51,6 +61,8 @@ class ModularHubInterface(Module):
             model_path: str,
             sentencepiece_prefix: str,
             dictionary_path: str,
+            shortlist_prefix: Optional[str] = None,
+            shortlist_frequent: int = 1000,
     ):
         x = hub_utils.from_pretrained(
             "./",
@@ -66,11 +78,27 @@ class ModularHubInterface(Module):
             ) for lang in x["task"].langs
         }
 
+        shortlists = {}
+        if shortlist_prefix is not None:
+            for lang_pair in x["task"].model_lang_pairs:
+                src_lang, tgt_lang = lang_pair.split("-")
+                shortlist_path = f"{shortlist_prefix}.{lang_pair}.txt"
+                if not os.path.isfile(shortlist_path):
+                    logger.warning(f"Shortlist {shortlist_path} not found, using full vocabulary for {lang_pair}.")
+                    continue
+                shortlists[lang_pair] = Shortlist.load(
+                    shortlist_path,
+                    src_dict=x["task"].dicts[src_lang],
+                    tgt_dict=x["task"].dicts[tgt_lang],
+                    frequent=shortlist_frequent
+                )
+
         return cls(
             models=x["models"],
             task=x["task"],
             cfg=x["args"],
             sp_models=sp_models,
+            shortlists=shortlists,
         )
 
     @property
@@ -109,6 +137,7 @@ class ModularHubInterface(Module):
             beam: int = 5,
             max_sentences: Optional[int] = 10,
             max_tokens: Optional[int] = 1000,
+            use_shortlist: bool = True,
     ) -> List[str]:
         """
         :param sentences: list of sentences to be translated
@@ -117,6 +146,7 @@ class ModularHubInterface(Module):
         :param beam: beam size for the beam search algorithm (decoding)
         :param max_sentences: max number of sentences in each batch
         :param max_tokens: max number of tokens in each batch, all sentences must be shorter than max_tokens.
+        :param use_shortlist: restrict the output vocabulary with the shortlist of the language pair if one is loaded
         :return: list of translations corresponding to the input sentences
         """
         logger.debug(f"Translating from {src_language} to {tgt_language}")
@@ -127,7 +157,8 @@ class ModularHubInterface(Module):
             tgt_language,
             beam=beam,
             max_sentences=max_sentences,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            use_shortlist=use_shortlist
         )
         return [self.decode(hypos[0]["tokens"], tgt_language) for hypos in batched_hypos]
 
@@ -140,11 +171,14 @@ class ModularHubInterface(Module):
             max_sentences: Optional[int] = 10,
             max_tokens: Optional[int] = None,
             skip_invalid_size_inputs=False,
+            use_shortlist: bool = True,
     ) -> List[List[Dict[str, Tensor]]]:
         gen_args = copy.deepcopy(self.cfg.generation)
         with open_dict(gen_args):
             gen_args.beam = beam
         generator = self._build_generator(src_lang, tgt_lang, gen_args)
+        lang_pair = f"{src_lang}-{tgt_lang}"
+        shortlist = self.shortlists.get(lang_pair) if use_shortlist else None
 
         results = []
         for batch in self._build_batches(
@@ -156,9 +190,11 @@ class ModularHubInterface(Module):
                 max_tokens=max_tokens
         ):
             batch = utils.apply_to_sample(lambda t: t.to(self.device), batch)
-            translations = self.task.inference_step(
-                generator, self.models, batch
-            )
+            candidates = shortlist.candidates(batch["net_input"]["src_tokens"]) if shortlist is not None else None
+            with restrict_output(self.shortlist_projections.get(lang_pair, []), candidates):
+                translations = self.task.inference_step(
+                    generator, self.models, batch
+                )
             for id, hypos in zip(batch["id"].tolist(), translations):
                 results.append((id, hypos))
 
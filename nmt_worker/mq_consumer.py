@@ -1,9 +1,8 @@
-import json
 import logging
 import hashlib
 import threading
-from sys import getsizeof
 from time import time, sleep
+from typing import Optional
 
 from pydantic import ValidationError
 
@@ -12,12 +11,18 @@ import pika.exceptions
 from pika import credentials, BlockingConnection, ConnectionParameters
 
 from nmt_worker.schemas import Response, Request, InputType
-from nmt_worker.translator import Translator
-from nmt_worker.config import mq_config
+from nmt_worker.translator import Translator, SHARD_THREAD_PREFIX
+from nmt_worker.config import mq_config, worker_config
+from nmt_worker.stats import LoadStats
+from nmt_worker.profiler import Profiler
+from nmt_worker.serialization import loads, compress, SerializationError, JSON, CONTENT_TYPES
 
 logger = logging.getLogger(__name__)
 
 X_EXPIRES = 60000
+QUEUE_DEPTH_INTERVAL = 5
+# max decompressed body size relative to max_input_length, allows for escaped non-ASCII characters in JSON
+MAX_BODY_SIZE_FACTOR = 16
 
 
 class MQConsumer:
@@ -29,8 +34,18 @@ class MQConsumer:
         self.translator = translator
         self.routing_keys = []
         self.queue_name = None
+        self.connection = None
         self.channel = None
-
+        self.stats = LoadStats(window=worker_config.stats_window,
+                               max_queue_depth=worker_config.saturation_queue_depth,
+                               max_latency=worker_config.saturation_latency)
+        self.profiler = Profiler(interval=worker_config.profiling_interval,
+                                 slow_request_threshold=worker_config.slow_request_threshold,
+                                 output_dir=worker_config.slow_request_dir,
+                                 thread_name_prefix=SHARD_THREAD_PREFIX)
+        self.translator.shard_context = self.profiler.profile_operators
+
+        compress(b'', worker_config.compression)  # fail early if the response compression is not supported
         self._generate_queue_config()
 
     def _generate_queue_config(self):
@@ -59,6 +74,7 @@ class MQConsumer:
         is lost.
         """
         t = threading.current_thread()
+        self.profiler.thread_id = t.ident
         while getattr(t, "consume", True):
             try:
                 self._connect()
@@ -78,16 +94,42 @@ class MQConsumer:
         if not getattr(t, "consume", True):
             logger.info('Interrupted by user. Exiting...')
 
-        self.channel.close()
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
         setattr(t, "connected", False)
 
+    def stop(self):
+        """
+        Stop consuming new requests. Can be called from any thread, the request that is currently being processed is
+        finished, responded to and acknowledged before the consumer thread exits.
+        """
+        if self.connection is None:
+            return
+        try:
+            self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+        except pika.exceptions.AMQPError:
+            pass  # not connected, the consumer thread exits before reconnecting
+
+    def _update_queue_depth(self):
+        """
+        Check the number of messages waiting in the queue and schedule the next check.
+        """
+        try:
+            result = self.channel.queue_declare(queue=self.queue_name, passive=True)
+            self.stats.update_queue_depth(result.method.message_count)
+        except pika.exceptions.AMQPError as e:
+            logger.warning(f'Unable to check queue depth: {e}')
+            self.stats.update_queue_depth(None)
+            return
+        self.connection.call_later(QUEUE_DEPTH_INTERVAL, self._update_queue_depth)
+
     def _connect(self):
         """
         Connects to RabbitMQ, (re)declares the exchange for the service and a queue for the worker binding
         any alternative routing keys as needed.
         """
         logger.info(f'Connecting to RabbitMQ server: {{host: {mq_config.host}, port: {mq_config.port}}}')
-        connection = BlockingConnection(ConnectionParameters(
+        self.connection = BlockingConnection(ConnectionParameters(
             host=mq_config.host,
             port=mq_config.port,
             credentials=credentials.PlainCredentials(
@@ -99,7 +141,7 @@ class MQConsumer:
                 'connection_name': mq_config.connection_name
             }
         ))
-        self.channel = connection.channel()
+        self.channel = self.connection.channel()
         self.channel.queue_declare(queue=self.queue_name, arguments={
             'x-expires': X_EXPIRES
         })
@@ -111,10 +153,12 @@ class MQConsumer:
 
         self.channel.basic_qos(prefetch_count=1)
         self.channel.basic_consume(queue=self.queue_name, on_message_callback=self._on_request)
+        self._update_queue_depth()
 
     @staticmethod
     def _respond(channel: pika.adapters.blocking_connection.BlockingChannel, method: pika.spec.Basic.Deliver,
-                 properties: pika.BasicProperties, body: bytes):
+                 properties: pika.BasicProperties, body: bytes, content_type: str = JSON,
+                 content_encoding: Optional[str] = None):
         """
         Publish the response to the callback queue and acknowledge the original queue item.
         """
@@ -122,7 +166,8 @@ class MQConsumer:
                               routing_key=properties.reply_to,
                               properties=pika.BasicProperties(
                                   correlation_id=properties.correlation_id,
-                                  content_type='application/json',
+                                  content_type=content_type,
+                                  content_encoding=content_encoding,
                                   headers={
                                       'RequestId': properties.headers["RequestId"],
                                       'MT-MessageType': properties.headers["ReturnMessageType"]
@@ -136,22 +181,36 @@ class MQConsumer:
         Pass the request to the worker and return its response.
         """
         t1 = time()
-        logger.info(f"Received request: {{id: {properties.correlation_id}, size: {getsizeof(body)} bytes}}")
+        self.stats.request_started()
+        logger.info(f"Received request: {{id: {properties.correlation_id}, size: {len(body)} bytes}}")
+        # respond in the same format as the request, unknown content types are parsed and answered as JSON
+        content_type = properties.content_type if properties.content_type in CONTENT_TYPES else JSON
         try:
-            request = json.loads(body)
-            request = Request(**request)
-            response = self.translator.process_request(request)
+            request = loads(body, properties.content_type, properties.content_encoding,
+                            max_size=worker_config.max_input_length * MAX_BODY_SIZE_FACTOR)
+            request = Request.parse_message(request)
+            with self.profiler.request(properties.correlation_id):
+                response = self.translator.process_request(request)
         except ValidationError as error:
             response = Response(status=f'Error parsing input: {str(error)}', status_code=400)
+        except SerializationError as error:
+            content_type = JSON
+            response = Response(status=f'Error parsing input: {str(error)}', status_code=400)
         except Exception as e:
             logger.exception(f'Unexpected error: {e}')
             response = Response(status_code=500, status="Unknown internal error.")
 
-        response = response.encode()
-        response_size = getsizeof(response)
+        response = response.encode(content_type)
+        content_encoding = None
+        if worker_config.compression is not None and len(response) >= worker_config.compression_threshold:
+            response = compress(response, worker_config.compression)
+            content_encoding = worker_config.compression
 
-        self._respond(channel, method, properties, response)
-        t2 = time()
+        try:
+            self._respond(channel, method, properties, response, content_type, content_encoding)
+        finally:
+            t2 = time()
+            self.stats.request_finished(t2 - t1, len(body))
 
         logger.info(f"Request processed: {{id: {properties.correlation_id}, duration: {round(t2 - t1, 3)} s, "
-                    f"size: {response_size} bytes}}")
+                    f"size: {len(response)} bytes}}")
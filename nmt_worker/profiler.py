@@ -0,0 +1,169 @@
+"""
+A sampling profiler for the consumer thread and the translation shard threads. Python stacks are sampled from another
+thread and returned in the folded stack format that is supported by flamegraph.pl, speedscope and other flame graph
+tools, with the thread name as the root frame. PyTorch operators are profiled with `torch.profiler` in every thread
+that wraps its work in `profile_operators` while a capture is running.
+"""
+import os
+import re
+import sys
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import time, sleep, strftime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WATCHDOG_INTERVAL = 0.1
+SLOW_PROFILE_COOLDOWN = 60
+
+
+def _folded_stack(frame, thread_name: str) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.append(thread_name)
+    return ';'.join(reversed(stack))
+
+
+def format_folded(stacks: Counter) -> str:
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class Profiler:
+    def __init__(self, interval: float = 0.01, slow_request_threshold: float = 0, output_dir: str = '/tmp/profiles',
+                 thread_name_prefix: Optional[str] = None):
+        """
+        :param interval: sampling interval in seconds
+        :param slow_request_threshold: if a request takes longer than this many seconds, the stacks are sampled until
+        the request is finished and saved to output_dir, 0 disables the trigger
+        :param output_dir: directory where the profiles of slow requests are saved
+        :param thread_name_prefix: threads with names starting with this prefix are sampled in addition to the
+        profiled thread
+        """
+        self.interval = interval
+        self.slow_request_threshold = slow_request_threshold
+        self.output_dir = output_dir
+        self.thread_name_prefix = thread_name_prefix
+        self.thread_id: Optional[int] = None  # the identifier of the profiled thread
+
+        self._capture_lock = threading.Lock()
+        self._profile_torch = False
+        self._operators: Dict[str, List[float]] = {}  # name: [calls, self CPU time, total CPU time]
+        self._operators_lock = threading.Lock()
+        self._request_id = None
+        self._request_start = None
+        self._last_slow_profile = 0
+
+        if slow_request_threshold > 0:
+            threading.Thread(target=self._watch_slow_requests, name='SlowRequestProfiler', daemon=True).start()
+
+    def _sample(self, stacks: Counter):
+        threads = {thread.ident: thread.name for thread in threading.enumerate()
+                   if thread.ident == self.thread_id or
+                   (self.thread_name_prefix and thread.name.startswith(self.thread_name_prefix))}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in threads:
+                stacks[_folded_stack(frame, threads[thread_id])] += 1
+
+    def capture(self, duration: float) -> str:
+        """
+        Sample the stacks of the profiled threads for the given number of seconds and profile PyTorch operators of all
+        requests and shards that start during the capture. Only one capture can run at a time.
+
+        :return: sampled stacks in the folded stack format
+        """
+        if not self._capture_lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already being captured.")
+        try:
+            stacks = Counter()
+            with self._operators_lock:
+                self._operators = {}
+            self._profile_torch = True
+            end = time() + duration
+            while time() < end:
+                self._sample(stacks)
+                sleep(self.interval)
+            return format_folded(stacks)
+        finally:
+            self._profile_torch = False
+            self._capture_lock.release()
+
+    def operator_summary(self, limit: int = 50) -> str:
+        """
+        A table of PyTorch operators profiled during the last capture, sorted by self CPU time.
+        """
+        with self._operators_lock:
+            operators = [(name, list(stats)) for name, stats in self._operators.items()]
+        operators = sorted(operators, key=lambda item: item[1][1], reverse=True)[:limit]
+        lines = [f"{'Operator':<60} {'Calls':>10} {'Self CPU (ms)':>15} {'CPU total (ms)':>15}"]
+        for name, (calls, self_cpu, cpu_total) in operators:
+            lines.append(f"{name[:60]:<60} {calls:>10} {self_cpu / 1000:>15.3f} {cpu_total / 1000:>15.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def _add_operators(self, events):
+        with self._operators_lock:
+            for event in events:
+                stats = self._operators.setdefault(event.key, [0, 0.0, 0.0])
+                stats[0] += event.count
+                stats[1] += event.self_cpu_time_total
+                stats[2] += event.cpu_time_total
+
+    @contextmanager
+    def profile_operators(self):
+        """
+        Profile PyTorch operators of the current thread within the context if a capture is running.
+        """
+        if self._profile_torch:
+            from torch.profiler import profile, ProfilerActivity
+            with profile(activities=[ProfilerActivity.CPU]) as prof:
+                yield
+            self._add_operators(prof.key_averages())
+        else:
+            yield
+
+    @contextmanager
+    def request(self, request_id: str):
+        """
+        Wraps the processing of a request in the profiled thread.
+        """
+        self._request_id = request_id
+        self._request_start = time()
+        try:
+            with self.profile_operators():
+                yield
+        finally:
+            self._request_start = None
+
+    def _watch_slow_requests(self):
+        while True:
+            start = self._request_start
+            if start is None or time() - start < self.slow_request_threshold or \
+                    time() - self._last_slow_profile < SLOW_PROFILE_COOLDOWN:
+                sleep(WATCHDOG_INTERVAL)
+                continue
+
+            request_id = self._request_id
+            stacks = Counter()
+            while self._request_start == start:
+                self._sample(stacks)
+                sleep(self.interval)
+            self._last_slow_profile = time()
+            self._save(stacks, request_id, time() - start)
+
+    def _save(self, stacks: Counter, request_id: str, duration: float):
+        file_name = f"{strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9_-]', '', str(request_id))}.folded"
+        path = os.path.join(self.output_dir, file_name)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(format_folded(stacks))
+        except OSError as e:
+            logger.warning(f"Unable to save slow request profile: {e}")
+            return
+        logger.warning(f"Slow request: {{id: {request_id}, duration: {round(duration, 3)} s}}, "
+                       f"profile saved to {path}")
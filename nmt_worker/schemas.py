@@ -1,12 +1,11 @@
-import json
 from enum import Enum
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
 from pydantic import BaseModel, Field
 from pydantic.dataclasses import dataclass
-from pydantic.json import pydantic_encoder
 
 from nmt_worker import worker_config
+from nmt_worker.serialization import dumps, JSON
 
 
 class InputType(Enum):
@@ -16,6 +15,9 @@ class InputType(Enum):
     ASR = 'asr'
 
 
+INPUT_TYPES = {input_type.value for input_type in InputType}
+
+
 class Request(BaseModel):
     """
     A class that can be used to store NMT requests
@@ -25,6 +27,33 @@ class Request(BaseModel):
     tgt: str
     domain: str
     input_type: InputType = InputType.PLAIN
+    session_id: Optional[str] = None  # groups partial transcripts of the same ASR stream
+
+    @classmethod
+    def parse_message(cls, data: Any) -> 'Request':
+        """
+        Create a request from a decoded message. Well-formed messages are checked with plain type checks and
+        constructed without pydantic validation, anything else is validated by pydantic for type coercion and error
+        messages.
+        """
+        if isinstance(data, dict) and cls._is_well_formed(data):
+            values = {key: value for key, value in data.items() if key in cls.__fields__}
+            if 'input_type' in values:
+                values['input_type'] = InputType(values['input_type'])
+            return cls.construct(**values)
+        return cls.parse_obj(data)
+
+    @staticmethod
+    def _is_well_formed(data: dict) -> bool:
+        text = data.get('text')
+        if isinstance(text, str):
+            if len(text) > worker_config.max_input_length:
+                return False
+        elif not isinstance(text, list) or not all(isinstance(item, str) for item in text):
+            return False
+        return all(isinstance(data.get(key), str) for key in ('src', 'tgt', 'domain')) and \
+            data.get('input_type', InputType.PLAIN.value) in INPUT_TYPES and \
+            isinstance(data.get('session_id', ''), (str, type(None)))
 
 
 @dataclass
@@ -36,5 +65,9 @@ class Response:
     status_code: int = 200
     status: str = 'OK'
 
-    def encode(self) -> bytes:
-        return json.dumps(self, default=pydantic_encoder).encode()
+    def encode(self, content_type: str = JSON) -> bytes:
+        return dumps({
+            'translation': self.translation,
+            'status_code': self.status_code,
+            'status': self.status
+        }, content_type)
@@ -0,0 +1,113 @@
+"""
+Message body (de)serialization. JSON is used by default (with orjson if it is installed), msgpack is used if requested
+with the content type of the message. Message bodies can optionally be compressed with gzip or zstd (requires
+zstandard), as specified by the content encoding of the message.
+"""
+import gzip
+import json
+import zlib
+from typing import Any, Iterator, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack')
+CONTENT_TYPES = (JSON, *MSGPACK_TYPES)
+CONTENT_ENCODINGS = ('gzip', 'zstd')
+CHUNK_SIZE = 65536
+
+
+class SerializationError(ValueError):
+    pass
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise SerializationError("Content type application/msgpack is not supported by this worker.")
+    return msgpack
+
+
+def _import_zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise SerializationError("Content encoding zstd is not supported by this worker.")
+    return zstandard
+
+
+def compress(body: bytes, content_encoding: Optional[str]) -> bytes:
+    if content_encoding is None:
+        return body
+    elif content_encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    elif content_encoding == 'zstd':
+        return _import_zstd().ZstdCompressor().compress(body)
+    raise SerializationError(f"Unsupported content encoding: {content_encoding}")
+
+
+def _gzip_chunks(body: bytes) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while body and not decompressor.eof:
+        yield decompressor.decompress(body, CHUNK_SIZE)
+        body = decompressor.unconsumed_tail
+    if not decompressor.eof:
+        raise zlib.error("incomplete or truncated stream")
+
+
+def _zstd_chunks(body: bytes) -> Iterator[bytes]:
+    with _import_zstd().ZstdDecompressor().stream_reader(body) as reader:
+        while chunk := reader.read(CHUNK_SIZE):
+            yield chunk
+
+
+def decompress(body: bytes, content_encoding: Optional[str], max_size: Optional[int] = None) -> bytes:
+    """
+    Decompress the message body in chunks, raising a SerializationError if the decompressed body is larger than
+    max_size bytes.
+    """
+    if content_encoding is None or content_encoding == 'identity':
+        return body
+    elif content_encoding == 'gzip':
+        chunks, errors = _gzip_chunks(body), (zlib.error,)
+    elif content_encoding == 'zstd':
+        chunks, errors = _zstd_chunks(body), (_import_zstd().ZstdError,)
+    else:
+        raise SerializationError(f"Unsupported content encoding: {content_encoding}")
+
+    decompressed = bytearray()
+    try:
+        for chunk in chunks:
+            decompressed += chunk
+            if max_size is not None and len(decompressed) > max_size:
+                raise SerializationError(f"Decompressed message body exceeds {max_size} bytes.")
+    except errors as e:
+        raise SerializationError(f"Unable to decompress message body: {e}")
+    return bytes(decompressed)
+
+
+def loads(body: bytes, content_type: Optional[str] = None, content_encoding: Optional[str] = None,
+          max_size: Optional[int] = None) -> Any:
+    body = decompress(body, content_encoding, max_size)
+    msgpack = _import_msgpack() if content_type in MSGPACK_TYPES else None
+    try:
+        if msgpack is not None:
+            return msgpack.unpackb(body)
+        elif orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body)
+    except ValueError as e:
+        raise SerializationError(f"Unable to parse message body: {e}")
+
+
+def dumps(obj: Any, content_type: Optional[str] = None) -> bytes:
+    if content_type in MSGPACK_TYPES:
+        return _import_msgpack().packb(obj)
+    elif orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
@@ -0,0 +1,197 @@
+"""
+Lexical shortlists restrict the output projection of the decoder to a subset of the target vocabulary - the likely
+translations of the source tokens in the current batch and a fixed set of the most frequent target tokens.
+
+A shortlist file contains one source token per line followed by its candidate target tokens, all separated by
+whitespace: `src_token tgt_token1 tgt_token2 ...`. Tokens are sentencepiece pieces as they appear in the model
+dictionaries.
+"""
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager, ExitStack
+from typing import Dict, Iterable, List, Optional
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, LongTensor
+from torch.nn import Module, Linear
+
+from fairseq.data import Dictionary
+
+logger = logging.getLogger(__name__)
+
+
+class Shortlist:
+    def __init__(self, table: LongTensor, tgt_dict: Dictionary, frequent: int = 1000):
+        """
+        :param table: a tensor of shape (source vocabulary size, max candidates) that contains the candidate target
+        indices for each source index, padded with -1
+        :param tgt_dict: target dictionary
+        :param frequent: number of most frequent target tokens that are always included in the output vocabulary
+        """
+        self.table = table
+        # fairseq dictionaries are sorted by frequency with special symbols in the beginning
+        self.frequent = torch.arange(min(tgt_dict.nspecial + frequent, len(tgt_dict)))
+
+    @classmethod
+    def load(cls, path: str, src_dict: Dictionary, tgt_dict: Dictionary, frequent: int = 1000):
+        entries: Dict[int, List[int]] = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                tokens = line.split()
+                if not tokens:
+                    continue
+                src, *tgts = tokens
+                src_idx = src_dict.index(src)
+                if src_idx == src_dict.unk():
+                    continue
+                tgt_indices = [tgt_dict.index(tgt) for tgt in tgts]
+                entries[src_idx] = [idx for idx in tgt_indices if idx != tgt_dict.unk()]
+
+        width = max((len(tgts) for tgts in entries.values()), default=0)
+        table = torch.full((len(src_dict), width), -1, dtype=torch.long)
+        for src_idx, tgt_indices in entries.items():
+            table[src_idx, :len(tgt_indices)] = LongTensor(tgt_indices)
+
+        logger.debug(f"Loaded shortlist from {path}: {len(entries)} source tokens, up to {width} candidates each.")
+        return cls(table, tgt_dict, frequent)
+
+    def candidates(self, src_tokens: Tensor) -> LongTensor:
+        """
+        Returns a sorted tensor of target indices allowed for a batch of source tokens.
+        """
+        candidates = self.table[src_tokens.unique().cpu()].flatten()
+        return torch.cat([candidates[candidates >= 0], self.frequent]).unique()
+
+
+class ShortlistProjection(Module):
+    """
+    A drop-in replacement of the decoder output projection that computes logits only for the candidate tokens set by
+    `restrict` in the current thread. Other tokens receive a score of -inf. Without candidates, the full output
+    projection is used.
+    """
+
+    def __init__(self, projection: Linear):
+        super().__init__()
+        self.projection = projection
+        self._local = threading.local()
+
+    @property
+    def weight(self) -> Tensor:
+        return self.projection.weight
+
+    @contextmanager
+    def restrict(self, candidates: LongTensor):
+        candidates = candidates.to(self.weight.device)
+        self._local.candidates = candidates
+        self._local.weight = self.weight.index_select(0, candidates)
+        self._local.bias = None if self.projection.bias is None else self.projection.bias.index_select(0, candidates)
+        try:
+            yield
+        finally:
+            self._local.candidates = None
+            self._local.weight = None
+            self._local.bias = None
+
+    def forward(self, x: Tensor) -> Tensor:
+        candidates = getattr(self._local, "candidates", None)
+        if candidates is None:
+            return self.projection(x)
+
+        logits = F.linear(x, self._local.weight, self._local.bias)
+        output = logits.new_full((*logits.shape[:-1], self.weight.size(0)), float('-inf'))
+        return output.index_copy_(output.dim() - 1, candidates, logits)
+
+
+def install_projections(decoders: Iterable[Module]) -> List[ShortlistProjection]:
+    """
+    Wraps the output projection of each decoder with a ShortlistProjection (once per decoder instance, as decoders
+    can be shared between language pairs) and returns the projections.
+    """
+    projections = []
+    for decoder in decoders:
+        projection = getattr(decoder, "output_projection", None)
+        if projection is None:
+            logger.warning("Decoder has no output projection (adaptive softmax?), shortlist will not be applied.")
+            continue
+        if not isinstance(projection, ShortlistProjection):
+            projection = ShortlistProjection(projection)
+            decoder.output_projection = projection
+        if projection not in projections:
+            projections.append(projection)
+    return projections
+
+
+@contextmanager
+def restrict_output(projections: List[ShortlistProjection], candidates: Optional[LongTensor]):
+    """
+    Restricts the output vocabulary of all given projections to candidates within the context. Does nothing if
+    candidates is None.
+    """
+    with ExitStack() as stack:
+        if candidates is not None:
+            for projection in projections:
+                stack.enter_context(projection.restrict(candidates))
+        yield
+
+
+def _dice(count: int, src_count: int, tgt_count: int) -> float:
+    return 2 * count / (src_count + tgt_count)
+
+
+def _prune_candidates(cooccurrences: Dict[str, Counter], src_counts: Counter, tgt_counts: Counter, size: int):
+    for src, counts in cooccurrences.items():
+        if len(counts) > size:
+            kept = sorted(counts, key=lambda tgt: _dice(counts[tgt], src_counts[src], tgt_counts[tgt]),
+                          reverse=True)[:size]
+            cooccurrences[src] = Counter({tgt: counts[tgt] for tgt in kept})
+
+
+def build_shortlist(src_sentences: Iterable[List[str]], tgt_sentences: Iterable[List[str]],
+                    top_k: int = 50, min_count: int = 2, prune_every: int = 10000,
+                    prune_size: Optional[int] = None) -> Dict[str, List[str]]:
+    """
+    Builds a shortlist from a tokenized parallel corpus. Target tokens are ranked by the Dice coefficient of their
+    sentence-level co-occurrence with the source token. The corpus is processed as a stream and the co-occurrence
+    counts of each source token are periodically pruned to the best candidates so far to keep memory usage bounded,
+    which makes the counts of rare candidates approximate.
+
+    :param src_sentences: source sentences as lists of tokens
+    :param tgt_sentences: target sentences as lists of tokens
+    :param top_k: max number of candidates per source token
+    :param min_count: minimum number of co-occurrences for a candidate to be considered
+    :param prune_every: number of sentence pairs between pruning the co-occurrence counts
+    :param prune_size: number of candidates per source token kept when pruning, 4 * top_k by default
+    :return: a dictionary of source tokens and their ranked candidates
+    """
+    prune_size = prune_size or 4 * top_k
+    src_counts = Counter()
+    tgt_counts = Counter()
+    cooccurrences = defaultdict(Counter)
+
+    for idx, (src_tokens, tgt_tokens) in enumerate(zip(src_sentences, tgt_sentences), start=1):
+        src_tokens, tgt_tokens = set(src_tokens), set(tgt_tokens)
+        src_counts.update(src_tokens)
+        tgt_counts.update(tgt_tokens)
+        for src in src_tokens:
+            cooccurrences[src].update(tgt_tokens)
+        if idx % prune_every == 0:
+            _prune_candidates(cooccurrences, src_counts, tgt_counts, prune_size)
+            logger.debug(f"Processed {idx} sentence pairs.")
+
+    shortlist = {}
+    for src, counts in cooccurrences.items():
+        scores = {tgt: _dice(count, src_counts[src], tgt_counts[tgt])
+                  for tgt, count in counts.items() if count >= min_count}
+        candidates = sorted(scores, key=lambda tgt: (-scores[tgt], tgt))[:top_k]
+        if candidates:
+            shortlist[src] = candidates
+
+    return shortlist
+
+
+def write_shortlist(shortlist: Dict[str, List[str]], path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        for src, candidates in sorted(shortlist.items()):
+            f.write(' '.join([src, *candidates]) + '\n')
@@ -0,0 +1,84 @@
+import math
+import threading
+from collections import deque
+from time import time
+from typing import Dict, List, Optional, Any
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """
+    Nearest-rank percentile of a sorted list of values.
+    """
+    if not values:
+        return None
+    rank = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return round(values[rank], 3)
+
+
+class LoadStats:
+    def __init__(self, window: int = 60, max_queue_depth: int = 0, max_latency: float = 0):
+        """
+        Thread-safe load statistics of the worker that are collected by the consumer thread and reported by the health
+        API.
+
+        :param window: the length of the rolling window of throughput and latency statistics in seconds
+        :param max_queue_depth: the worker is saturated if at least this many messages are waiting in the queue,
+        0 disables the check
+        :param max_latency: the worker is saturated if the 90th percentile latency in the window reaches this many
+        seconds, 0 disables the check
+        """
+        self.window = window
+        self.max_queue_depth = max_queue_depth
+        self.max_latency = max_latency
+        self.in_flight = 0
+        self.queue_depth: Optional[int] = None
+        self.queue_depth_time: Optional[float] = None
+        self._requests = deque()  # (finish time, duration, size) tuples
+        self._lock = threading.Lock()
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, duration: float, size: int):
+        now = time()
+        with self._lock:
+            self.in_flight -= 1
+            self._requests.append((now, duration, size))
+            self._prune(now)
+
+    def update_queue_depth(self, queue_depth: Optional[int]):
+        with self._lock:
+            self.queue_depth = queue_depth
+            self.queue_depth_time = None if queue_depth is None else time()
+
+    def _prune(self, now: float):
+        while self._requests and self._requests[0][0] < now - self.window:
+            self._requests.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time()
+        with self._lock:
+            self._prune(now)
+            durations = sorted(duration for _, duration, _ in self._requests)
+            size = sum(size for _, _, size in self._requests)
+            in_flight = self.in_flight
+            queue_depth = self.queue_depth
+            queue_depth_time = self.queue_depth_time
+
+        latency = {f'p{p}': percentile(durations, p) for p in (50, 90, 99)}
+        saturated = (0 < self.max_queue_depth <= (queue_depth or 0)) or \
+                    (0 < self.max_latency <= (latency['p90'] or 0))
+
+        return {
+            'saturated': saturated,
+            'queue_depth': queue_depth,
+            # the queue depth is checked by the consumer thread and is not updated while a request is processed
+            'queue_depth_age': None if queue_depth_time is None else round(now - queue_depth_time, 3),
+            'in_flight': in_flight,
+            'window': self.window,
+            'requests': len(durations),
+            'requests_per_second': round(len(durations) / self.window, 3),
+            'bytes_per_second': round(size / self.window, 1),
+            'latency': latency
+        }
@@ -1,10 +1,13 @@
 import itertools
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from typing import List
 import warnings
 
-from .config import ModelConfig
-from .schemas import Response, Request
+from .config import ModelConfig, worker_config
+from .schemas import Response, Request, InputType
+from .asr_sessions import ASRSessionCache
 from .tag_utils import preprocess_tags, postprocess_tags
 from .normalization import normalize
 from .tokenization import sentence_tokenize
@@ -13,9 +16,15 @@ logger = logging.getLogger(__name__)
 
 warnings.filterwarnings('ignore', '.*__floordiv__*', )
 
+SHARD_THREAD_PREFIX = 'TranslationShard'
+
 
 class Translator:
     model = None
+    executor = None
+    shard_threads = None
+    asr_sessions = None
+    shard_context = nullcontext  # a context manager factory that wraps the translation of each shard
 
     def __init__(self, model_config: ModelConfig):
         self.model_config = model_config
@@ -32,6 +41,21 @@ class Translator:
         else:
             self.translate = self._translate
 
+        import torch
+        self.num_threads = torch.get_num_threads()
+        if worker_config.shard_threshold > 0:
+            self.shard_threads = worker_config.shard_threads or \
+                max(1, self.num_threads // worker_config.shard_workers)
+            self.executor = ThreadPoolExecutor(max_workers=worker_config.shard_workers,
+                                               thread_name_prefix=SHARD_THREAD_PREFIX)
+            logger.info(f"Texts of {worker_config.shard_threshold}+ characters will be translated in "
+                        f"{worker_config.shard_workers} parallel shards with {self.shard_threads} threads each.")
+
+        if worker_config.asr_session_ttl > 0:
+            self.asr_sessions = ASRSessionCache(ttl=worker_config.asr_session_ttl,
+                                                max_sessions=worker_config.asr_max_sessions,
+                                                max_sentences=worker_config.asr_max_sentences)
+
         logger.info(f"All NMT models loaded; "
                     f"language pairs: {self.model_config.language_pairs}; "
                     f"domains: {self.model_config.domains}")
@@ -42,8 +66,12 @@ class Translator:
             self.model = ModularHubInterface.from_pretrained(
                 model_path=self.model_config.checkpoint,
                 sentencepiece_prefix=self.model_config.sentencepiece_prefix,
-                dictionary_path=self.model_config.dict_dir)
+                dictionary_path=self.model_config.dict_dir,
+                shortlist_prefix=self.model_config.shortlist_prefix,
+                shortlist_frequent=self.model_config.shortlist_frequent)
         else:
+            if self.model_config.shortlist_prefix is not None:
+                logger.warning("Shortlists are only supported with modular models and will be ignored.")
             from fairseq.models.transformer import TransformerModel
             self.model = TransformerModel.from_pretrained(
                 "./",
@@ -59,6 +87,53 @@ class Translator:
     def _translate_modular(self, sentences: List[str], src: str, tgt: str, **_) -> List[str]:
         return self.model.translate(sentences, src_language=src, tgt_language=tgt)
 
+    @staticmethod
+    def _split_shards(sentences: List[str], n: int) -> List[List[str]]:
+        """
+        Split sentences into up to n consecutive shards with a roughly equal number of characters. Each split point
+        is chosen nearest to the k*total/n character boundary.
+        """
+        cumulative = list(itertools.accumulate(len(sentence) for sentence in sentences))
+        splits = [0]
+        for k in range(1, n):
+            target = k * cumulative[-1] / n
+            split = min(range(1, len(sentences)), key=lambda idx: abs(cumulative[idx - 1] - target), default=0)
+            if split > splits[-1]:
+                splits.append(split)
+        splits.append(len(sentences))
+        return [sentences[start:end] for start, end in zip(splits, splits[1:])]
+
+    def _translate_shard(self, sentences: List[str], **kwargs) -> List[str]:
+        import torch
+        # the thread count is process-wide with MKL/OpenMP builds and is reset by the consumer thread after each
+        # sharded request, so it is set again at the start of every shard
+        torch.set_num_threads(self.shard_threads)
+        with self.shard_context():
+            return self.translate(sentences, **kwargs)
+
+    def _translate_sharded(self, sentences: List[str], **kwargs) -> List[str]:
+        shards = self._split_shards(sentences, worker_config.shard_workers)
+        if len(shards) == 1:
+            return self.translate(sentences, **kwargs)
+
+        import torch
+        logger.debug(f"Translating {len(sentences)} sentences in {len(shards)} shards.")
+        try:
+            futures = [self.executor.submit(self._translate_shard, shard, **kwargs) for shard in shards]
+            return list(itertools.chain.from_iterable(future.result() for future in futures))
+        finally:
+            # restore the thread count of unsharded translation
+            torch.set_num_threads(self.num_threads)
+
+    def _translate_sentences(self, sentences: List[str], **kwargs) -> List[str]:
+        """
+        Translate sentences in parallel shards if they are long enough, otherwise with a single call.
+        """
+        if self.executor is not None and len(sentences) > 1 and \
+                sum(len(sentence) for sentence in sentences) >= worker_config.shard_threshold:
+            return self._translate_sharded(sentences, **kwargs)
+        return self.translate(sentences, **kwargs)
+
     def process_request(self, request: Request) -> Response:
         inputs = [request.text] if type(request.text) == str else request.text
         translations = []
@@ -70,8 +145,13 @@ class Translator:
 
             detagged, tags = preprocess_tags(sentences, request.input_type)
             normalized = [normalize(sentence) for sentence in detagged]
-            translated = [translation if normalized[idx] != '' else '' for idx, translation in enumerate(
-                self.translate(normalized, src=request.src, tgt=request.tgt, domain=request.domain))]
+            if self.asr_sessions is not None and request.input_type == InputType.ASR and request.session_id:
+                translated = self.asr_sessions.translate(normalized, request.session_id, self._translate_sentences,
+                                                         src=request.src, tgt=request.tgt, domain=request.domain)
+            else:
+                translated = self._translate_sentences(normalized, src=request.src, tgt=request.tgt,
+                                                       domain=request.domain)
+            translated = [translation if normalized[idx] != '' else '' for idx, translation in enumerate(translated)]
             retagged = postprocess_tags(translated, tags, request.input_type)
             translations.append(''.join(itertools.chain.from_iterable(zip(delimiters, retagged))) + delimiters[-1])
 
@@ -0,0 +1,141 @@
+"""
+Tools for building lexical shortlists from a parallel corpus and comparing the quality and speed of translation with
+and without them.
+
+python shortlist.py build --model-config models/config.yaml --lang-pair et-en --source corpus.et --target corpus.en
+python shortlist.py compare --model-config models/config.yaml --lang-pair et-en --input test.et [--reference test.en]
+"""
+import os
+import logging
+from argparse import ArgumentParser
+from itertools import islice
+from time import time
+from typing import Iterator
+
+from sentencepiece import SentencePieceProcessor
+
+from nmt_worker import read_model_config, ModelConfig
+
+logger = logging.getLogger("shortlist")
+
+
+def _sp_model(model_config: ModelConfig, language: str) -> SentencePieceProcessor:
+    if model_config.modular:
+        model_file = f"{model_config.sentencepiece_prefix}.{language}.model"
+    else:
+        model_file = f"{model_config.sentencepiece_prefix}.model"
+    return SentencePieceProcessor(model_file=model_file)
+
+
+def _read_lines(path: str, max_lines: int = None) -> Iterator[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in islice(f, max_lines):
+            yield line.strip()
+
+
+def build(args):
+    from nmt_worker.shortlist import build_shortlist, write_shortlist
+
+    model_config = read_model_config(args.model_config)
+    src_lang, tgt_lang = args.lang_pair.split('-')
+    src_sp, tgt_sp = _sp_model(model_config, src_lang), _sp_model(model_config, tgt_lang)
+
+    src_sentences = (src_sp.encode(line, out_type=str) for line in _read_lines(args.source, args.max_lines))
+    tgt_sentences = (tgt_sp.encode(line, out_type=str) for line in _read_lines(args.target, args.max_lines))
+    shortlist = build_shortlist(src_sentences, tgt_sentences, top_k=args.top_k, min_count=args.min_count,
+                                prune_every=args.prune_every, prune_size=args.prune_size)
+
+    prefix = model_config.shortlist_prefix or os.path.join(model_config.model_root, "shortlist")
+    output = args.output or f"{prefix}.{args.lang_pair}.txt"
+    write_shortlist(shortlist, output)
+    logger.info(f"Shortlist with {len(shortlist)} source tokens saved to {output}.")
+
+
+def compare(args):
+    from nmt_worker import Translator
+
+    model_config = read_model_config(args.model_config)
+    if not model_config.modular or model_config.shortlist_prefix is None:
+        raise ValueError("Shortlists can only be compared for modular models with `shortlist_prefix` configured.")
+    src_lang, tgt_lang = args.lang_pair.split('-')
+    sentences = list(_read_lines(args.input, args.max_lines))
+    if not sentences:
+        raise ValueError(f"No sentences in {args.input}.")
+    characters = sum(len(sentence) for sentence in sentences)
+
+    translator = Translator(model_config)
+    if args.lang_pair not in translator.model.shortlists:
+        raise ValueError(f"No shortlist loaded for {args.lang_pair}.")
+
+    def translate(use_shortlist: bool):
+        return translator.model.translate(sentences, src_language=src_lang, tgt_language=tgt_lang,
+                                          use_shortlist=use_shortlist)
+
+    # warm up both modes, then alternate the order of timed runs and keep the fastest run of each mode
+    for use_shortlist in (False, True):
+        translator.model.translate(sentences[:args.warmup], src_language=src_lang, tgt_language=tgt_lang,
+                                   use_shortlist=use_shortlist)
+
+    results = {}
+    durations = {False: float('inf'), True: float('inf')}
+    for run in range(args.repeat):
+        for use_shortlist in ((False, True) if run % 2 == 0 else (True, False)):
+            t1 = time()
+            results[use_shortlist] = translate(use_shortlist)
+            durations[use_shortlist] = min(durations[use_shortlist], time() - t1)
+
+    for use_shortlist, duration in durations.items():
+        logger.info(f"{'Shortlist' if use_shortlist else 'Full vocabulary'}: {round(duration, 3)} s, "
+                    f"{round(len(sentences) / duration, 2)} sentences/s, {round(characters / duration)} chars/s")
+
+    identical = sum(full == short for full, short in zip(results[False], results[True]))
+    logger.info(f"Identical translations: {identical}/{len(sentences)} ({round(100 * identical / len(sentences), 2)}%)")
+
+    if args.reference is not None:
+        try:
+            import sacrebleu
+        except ImportError:
+            logger.warning("BLEU scores are not reported because sacrebleu is not installed.")
+            return
+        references = list(_read_lines(args.reference, args.max_lines))
+        for use_shortlist, translations in results.items():
+            bleu = sacrebleu.corpus_bleu(translations, [references])
+            logger.info(f"{'Shortlist' if use_shortlist else 'Full vocabulary'}: {bleu}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Build lexical shortlists and compare translations with and without them.")
+    subparsers = parser.add_subparsers(required=True)
+
+    build_parser = subparsers.add_parser('build', help="Build a shortlist from a parallel corpus.")
+    build_parser.set_defaults(func=build)
+    build_parser.add_argument('--source', required=True, help="Source side of the parallel corpus.")
+    build_parser.add_argument('--target', required=True, help="Target side of the parallel corpus.")
+    build_parser.add_argument('--output', default=None,
+                              help="Output file, `{shortlist_prefix}.{src}-{tgt}.txt` of the model by default.")
+    build_parser.add_argument('--top-k', type=int, default=50, help="Max number of candidates per source token.")
+    build_parser.add_argument('--min-count', type=int, default=2,
+                              help="Minimum number of co-occurrences for a candidate.")
+    build_parser.add_argument('--prune-every', type=int, default=10000,
+                              help="Number of sentence pairs between pruning co-occurrence counts to bound memory.")
+    build_parser.add_argument('--prune-size', type=int, default=None,
+                              help="Number of candidates per source token kept when pruning, 4 * top-k by default.")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare translations with and without a shortlist.")
+    compare_parser.set_defaults(func=compare)
+    compare_parser.add_argument('--input', required=True, help="Source sentences, one per line.")
+    compare_parser.add_argument('--reference', default=None,
+                                help="Reference translations, one per line (optional, requires sacrebleu).")
+    compare_parser.add_argument('--warmup', type=int, default=10,
+                                help="Number of sentences translated in both modes before timing.")
+    compare_parser.add_argument('--repeat', type=int, default=3,
+                                help="Number of timed runs per mode, the fastest one is reported.")
+
+    for subparser in (build_parser, compare_parser):
+        subparser.add_argument('--model-config', default='models/config.yaml', help="The model config YAML file.")
+        subparser.add_argument('--lang-pair', required=True, help="Hyphen-separated language pair, e.g. `et-en`.")
+        subparser.add_argument('--max-lines', type=int, default=None, help="Max number of lines to read.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] [%(name)s]: %(message)s")
+    args.func(args)